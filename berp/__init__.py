@@ -3,20 +3,92 @@
 import enum
 from . import oids
 
-def decode_varint(bytearr):
-    value = bytearr[0] & 0x7f
-    while bytearr.pop(0) & 0x80:
-        value = (value << 7) | (bytearr[0] & 0x7f)
-    return value
+DER_TAG_EXTENDED = 0x1f
 
-def encode_varint(n):
-    res = [n & 0x7f]
-    n >>= 7
-    while n:
-        res.append((n & 0x7f) | 0x80)
-        n >>= 7
+def decode_varint(buf, pos=0):
+    """ decode a base-128 varint from buf at pos; returns (value, new_pos) """
+    if pos < 0:
+        raise ValueError("negative position")
+    value = 0
+    try:
+        while True:
+            b = buf[pos]
+            pos += 1
+            value = (value << 7) | (b & 0x7f)
+            if not b & 0x80:
+                return value, pos
+    except IndexError:
+        raise ValueError("truncated varint") from None
+
+def decode_varints(buf, pos=0):
+    """ decode the consecutive varints filling buf[pos:]; returns a list of values """
+    if pos < 0:
+        raise ValueError("negative position")
+    if not isinstance(buf, (bytes, bytearray)):
+        buf = bytes(buf)
+    values = []
+    value = 0
+    pending = False  # inside a varint whose last byte hasn't been seen yet
+    end = len(buf)
+    while pos < end:
+        chunk = buf[pos:pos + 8]
+        pos += 8
+        if not pending and chunk.isascii():
+            # no continuation bits in the whole chunk: every byte is a value
+            values.extend(chunk)
+            continue
+        for b in chunk:
+            value = (value << 7) | (b & 0x7f)
+            pending = bool(b & 0x80)
+            if not pending:
+                values.append(value)
+                value = 0
+    if pending:
+        raise ValueError("truncated varint")
+    return values
+
+def decode_header(buf, pos, end):
+    """ decode a tag+length header from buf[pos:end];
+        returns (tag, cons, asn1cls, length, new_pos), length is None for indefinite """
+    if pos < 0:
+        raise ValueError("negative position")
+    end = min(end, len(buf))
+    if pos >= end:
+        raise ValueError("truncated der header")
+    head = buf[pos]
+    pos += 1
+    asn_cls, cons, tag = head >> 6, (head >> 5) & 1, head & 0x1f
+    if tag == DER_TAG_EXTENDED:
+        tag, pos = decode_varint(buf, pos)
+    if pos >= end:
+        raise ValueError("truncated der header")
+
+    length = buf[pos]
+    pos += 1
+    if length > 0x80:
+        byte_count = length & 0x7f
+        if pos + byte_count > end:
+            raise ValueError("bad der length")
+        length = int.from_bytes(buf[pos:pos + byte_count], 'big')
+        pos += byte_count
+
+    elif length == 0x80:
+        length = None
+    return (tag, cons, asn_cls, length, pos)
 
-    return bytes(reversed(res))
+def encode_varint(n):
+    nbytes = max(1, (n.bit_length() + 6) // 7)
+    out = bytearray(nbytes)
+    last = nbytes - 1
+    for i in range(nbytes):
+        out[i] = ((n >> (7 * (last - i))) & 0x7f) | (0x80 if i != last else 0)
+    return bytes(out)
+
+try:
+    # optional compiled versions of the above (`cythonize -i berp/_fast.pyx`)
+    from ._fast import decode_varint, decode_varints, encode_varint, decode_header
+except ImportError:
+    pass
 
 class BitField:
     def __init__(self, value=0):
@@ -29,25 +101,34 @@ class BitField:
 
     def __getitem__(self, sl):
         if isinstance(sl, slice):
-            bits = bin(self.value)[2:][::-1]
-            return int(bits[sl][::-1] or '0', 2)
+            start, stop, step = sl.indices(self.value.bit_length())
+            if step == 1:
+                return (self.value >> start) & ((1 << max(stop - start, 0)) - 1)
+            return sum(((self.value >> bit) & 1) << i
+                       for i, bit in enumerate(range(start, stop, step)))
         else:
             return (self.value >> sl.__index__()) & 1
 
     def __setitem__(self, sl, value):
         if isinstance(sl, slice):
             size = max(sl.start or 0, sl.stop or 0, self.value.bit_length())
-            bits = list(bin(self.value)[2:].zfill(size)[::-1])
-            bits[sl] = list(bin(value)[2:].zfill(len(bits[sl]))[::-1])
-            self.value = int(''.join(reversed(bits)), 2)
+            step = sl.step or 1
+            if sl.stop is None and step > 0:
+                # open-ended slice grows to fit the assigned value
+                size = max(size, (sl.start or 0) + step * value.bit_length())
+            start, stop, step = sl.indices(size)
+            if step == 1:
+                mask = ((1 << max(stop - start, 0)) - 1) << start
+                self.value = (self.value & ~mask) | ((value << start) & mask)
+                return
+            for i, bit in enumerate(range(start, stop, step)):
+                self.value = (self.value & ~(1 << bit)) | (((value >> i) & 1) << bit)
         else:
             self.value |= (bool(value) << sl.__index__())
     
     def __repr__(self):
         return f'<BitField({self.value:#x})>'
 
-DER_TAG_EXTENDED = 0x1f
-
 class ASN1Tag(enum.IntEnum):
     EOC = 0
     Boolean = 1
@@ -72,8 +153,26 @@ class ASN1Class(enum.IntEnum):
     Context = 2
     Private = 3
 
+# indexed by the 2-bit class field; avoids the enum lookup per decoded tag
+_ASN1_CLASSES = tuple(ASN1Class)
+
+# (tag, cons, asn1cls) -> class, for classes defined in code
+_REGISTRY = {}
+# (base, tag, cons, asn1cls) -> class synthesized for an unknown tag, so it's
+# only ever created once and instances from different parses share it
+_DYN_CLASSES = {}
+# (find_class receiver, tag, cons, asn1cls) -> result for unregistered tags
+_DYN_LOOKUP = {}
+
 class ASN1Object:
     CONS = CLASS = TAG = None
+
+    def __init_subclass__(cls, register=True, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if register and None not in (cls.TAG, cls.CLASS, cls.CONS):
+            # first definition wins, so subclasses inheriting a tag don't shadow it
+            _REGISTRY.setdefault((cls.TAG, cls.CONS, cls.CLASS), cls)
+
     def __init__(self, value=None, *, data=None):
         if value is not None and data is not None:
             raise TypeError(f"{self.__class__.__name__}: must supply exactly one of `data`, `value`")
@@ -97,22 +196,27 @@ class ASN1Object:
         self.value = self._decode_value(data)
 
     def __bytes__(self):
+        parts = []
+        self._write(parts)
+        return b''.join(parts)
+
+    def _write(self, parts):
+        """ append the encoding (header, payload) to the list `parts`;
+            returns the encoded length """
+        payload = self.data
         # hack to suppoprt BER shit
-        length = len(self.data)
-        if getattr(self, '_indefinite', False):
-            length = None
-        return self._encode_header(length) + self.data
+        length = None if getattr(self, '_indefinite', False) else len(payload)
+        header = self._encode_header(length)
+        parts.append(header)
+        parts.append(payload)
+        return len(header) + len(payload)
 
     @classmethod
     def _encode_header(cls, length):
         tag, asn1cls, cons = cls.TAG, cls.CLASS, cls.CONS
         if tag >= 0x1f:  #extended
             tag = DER_TAG_EXTENDED
-        head = BitField()
-        head[6:8] = asn1cls
-        head[5] = cons
-        head[:5] = tag
-        data = bytearray([head])
+        data = bytearray([(asn1cls << 6) | (bool(cons) << 5) | (tag & 0x1f)])
         if tag == DER_TAG_EXTENDED:
             data += encode_varint(cls.TAG)
         if length is None:
@@ -125,49 +229,48 @@ class ASN1Object:
             data += length.to_bytes(byte_count, 'big')
         return bytes(data)
 
+    _decode_header = staticmethod(decode_header)
+
     @classmethod
-    def _decode_header(cls, bytearr):
-        head = BitField(bytearr.pop(0))
-        asn_cls, cons, tag = head[6:8], head[5], head[:5]
-        if tag == DER_TAG_EXTENDED:
-            tag = decode_varint(bytearr)
-        if len(bytearr) == 0:
-            raise ValueError("truncated der header")
-
-        length = bytearr.pop(0)
-        if length > 0x80:
-            byte_count = length & 0x7f
-            if byte_count > len(bytearr):
-                raise ValueError("bad der length")
-            length = int.from_bytes(bytearr[:byte_count], 'big')
-            bytearr[:byte_count] = b''
-
-        elif length == 0x80:
-            length = None
-        return (tag, cons, asn_cls, length, )
+    def _from_buffer(cls, buf, pos, end):
+        """ build an instance from the value octets in buf[pos:end] """
+        return cls(data=bytes(buf[pos:end]))
 
     @classmethod
-    def from_bytes(cls, data):
-        arr = bytearray(data)
-        tag, cons, asn1cls, length = cls._decode_header(arr)
-        asn1cls = ASN1Class(asn1cls)
+    def _parse(cls, buf, pos=0, end=None):
+        """ parse a single object from buf at pos; returns (obj, new_pos) """
+        if end is None:
+            end = len(buf)
+        start = pos
+        tag, cons, asn1cls, length, pos = cls._decode_header(buf, pos, end)
+        asn1cls = _ASN1_CLASSES[asn1cls]
         if length is not None:
-            if len(arr) < length:
+            if end - pos < length:
                 raise ValueError("Truncated DER object")
             indefinite = False
         else:
             indefinite = True
 
-        cls = cls.find_class(tag, cons, asn1cls)
+        header_end = pos
+        # any registered class will do when parsing generically (e.g. children)
+        found = _REGISTRY.get((tag, cons, asn1cls)) if cls is ASN1Object else None
+        cls = found or cls.find_class(tag, cons, asn1cls)
         if indefinite:
-            value, length = cls._decode_indefinite(arr)
+            value, pos = cls._decode_indefinite(buf, pos, end)
             obj = cls(value=value)
         else:
-            obj = cls(data=bytes(arr[:length]))
-        obj.header_length = len(data) - len(arr)
-        obj.length = obj.header_length + length
+            pos += length
+            obj = cls._from_buffer(buf, header_end, pos)
+        obj.header_length = header_end - start
+        obj.length = pos - start
         # hack
         obj._indefinite = indefinite
+        return obj, pos
+
+    @classmethod
+    def from_bytes(cls, data):
+        with memoryview(data) as buf:
+            obj, _ = cls._parse(buf)
         return obj
 
     def __repr__(self):
@@ -175,24 +278,47 @@ class ASN1Object:
 
     @classmethod
     def find_class(cls, tag, cons, asn1cls):
-        if cls.TAG == tag and cls.CONS == cons and cls.CLASS == asn1cls:
-            return cls
-
-        for subclass in cls.__subclasses__():
-            found = subclass.find_class(tag, cons, asn1cls)
+        found = _REGISTRY.get((tag, cons, asn1cls))
+        if found is not None and issubclass(found, cls):
+            return found
+        lookup_key = (cls, tag, cons, asn1cls)
+        found = _DYN_LOOKUP.get(lookup_key)
+        if found is None:
+            found = cls._synthesize_class(tag, cons, asn1cls)
             if found is not None:
-                return found
+                _DYN_LOOKUP[lookup_key] = found
+        return found
 
-        if cls.TAG is not None and cls.TAG != tag:
-            return None
-        if cls.CONS is not None and cls.CONS != cons:
-            return None
-        if cls.CLASS is not None and cls.CLASS != asn1cls:
+    @classmethod
+    def _matches(cls, tag, cons, asn1cls):
+        return (cls.TAG is None or cls.TAG == tag) and (cls.CONS is None or cls.CONS == cons) \
+                and (cls.CLASS is None or cls.CLASS == asn1cls)
+
+    @classmethod
+    def _synthesize_class(cls, tag, cons, asn1cls):
+        if not cls._matches(tag, cons, asn1cls):
             return None
+        # descend to the most specific class compatible with the tag, taking
+        # the first matching subclass at each level; visits each class at most once
+        base = cls
+        while None in (base.TAG, base.CONS, base.CLASS):
+            for subclass in base.__subclasses__():
+                if subclass._matches(tag, cons, asn1cls):
+                    base = subclass
+                    break
+            else:
+                break
+        else:
+            return base
 
-        # class not found; create new
-        return type(f"{ASN1Class(asn1cls).name}{'Cons' if cons else 'Prim'}[{tag:#x}]",
-                    (cls,), {'TAG': tag, 'CLASS': asn1cls, 'CONS': cons})
+        # class not found; create new, once per base
+        synth_key = (base, tag, cons, asn1cls)
+        new = _DYN_CLASSES.get(synth_key)
+        if new is None:
+            new = _DYN_CLASSES[synth_key] = type(
+                f"{_ASN1_CLASSES[asn1cls].name}{'Cons' if cons else 'Prim'}[{tag:#x}]",
+                (base,), {'TAG': tag, 'CLASS': asn1cls, 'CONS': cons}, register=False)
+        return new
 
     def __eq__(self, other):
         if not isinstance(other, ASN1Object):
@@ -202,31 +328,121 @@ class ASN1Object:
 
 class Constructed(ASN1Object):
     CONS = True
+    # encoded contents as parsed, kept only when they are exactly what
+    # re-encoding the children would produce; only valid while the children
+    # haven't been handed out, since any change to them has to go through `value`
+    _raw = None
+
+    @property
+    def value(self):
+        self._raw = None
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._raw = None
+        self._value = value
+
+    # read-only paths use `_value` so they don't drop `_raw`
+    def __eq__(self, other):
+        if not isinstance(other, Constructed):
+            return super().__eq__(other)
+        return (self.TAG, self.CLASS, self.CONS) == (other.TAG, other.CLASS, other.CONS) \
+                and self._value == other._value
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._value!r})"
+
+    @property
+    def data(self):
+        if self._raw is not None:
+            return self._raw
+        return self._encode_value(self._value)
+
+    @data.setter
+    def data(self, data):
+        self.value = self._decode_value(data)
 
     def _encode_value(self, value):
-        return b''.join(bytes(x) for x in value)
+        parts = []
+        self._write_children(parts, value)
+        return b''.join(parts)
+
+    @staticmethod
+    def _write_children(parts, value):
+        length = 0
+        for x in value:
+            if isinstance(x, ASN1Object):
+                length += x._write(parts)
+            else:
+                # already-encoded child
+                x = bytes(x)
+                parts.append(x)
+                length += len(x)
+        return length
+
+    def _write(self, parts):
+        if self._raw is not None or type(self)._encode_value is not Constructed._encode_value:
+            return super()._write(parts)
+        # reserve the header's slot, fill it in once the children's total
+        # length is known; every byte is copied once, by the final join
+        slot = len(parts)
+        parts.append(None)
+        length = self._write_children(parts, self._value)
+        header = self._encode_header(None if getattr(self, '_indefinite', False) else length)
+        parts[slot] = header
+        return len(header) + length
 
     def _decode_value(self, data):
+        buf = memoryview(bytes(data))
+        return self._decode_children(buf, 0, len(buf))
+
+    @classmethod
+    def _from_buffer(cls, buf, pos, end):
+        if cls._decode_value is not Constructed._decode_value:
+            # subclass decodes its own contents
+            return super()._from_buffer(buf, pos, end)
+        obj = cls(value=cls._decode_children(buf, pos, end))
+        obj._keep_raw(buf, pos, end)
+        return obj
+
+    def _keep_raw(self, buf, begin, end):
+        """ keep buf[begin:end] as the encoded contents if the freshly parsed
+            children re-encode to exactly those bytes (DER-style input) """
+        pos = begin
+        for x in self._value:
+            start, pos = pos, pos + x.length
+            if getattr(x, '_indefinite', False):
+                return
+            content = start + x.header_length
+            if buf[start:content] != x._encode_header(pos - content):
+                return
+            if isinstance(x, Constructed):
+                if x._raw is None:
+                    return
+            elif x.data != buf[content:pos]:
+                return
+        self._raw = bytes(buf[begin:end])
+
+    @staticmethod
+    def _decode_children(buf, pos, end):
         value = []
-        while data:
-            decoded = ASN1Object.from_bytes(data)
+        while pos < end:
+            decoded, pos = ASN1Object._parse(buf, pos, end)
             value.append(decoded)
-            data = data[decoded.length:]
         return value
 
     @classmethod
-    def _decode_indefinite(self, data):
+    def _decode_indefinite(cls, buf, pos, end):
         value = []
-        offset = 0
-        while offset < len(data):
-            decoded = ASN1Object.from_bytes(data[offset:])
+        while pos < end:
+            decoded, pos = ASN1Object._parse(buf, pos, end)
             value.append(decoded)
-            offset += decoded.length
             if isinstance(decoded, EOC):
                 break
         else:
             raise RuntimeError("truncated indefinite BER tag (no EOC marker)")
-        return value, offset
+        return value, pos
 
     def __iter__(self):
         return iter(self.value)
@@ -235,7 +451,7 @@ class Constructed(ASN1Object):
         return self.value[index]
 
     def __len__(self):
-        return len(self.value)
+        return len(self._value)
 
 
 class Universal(ASN1Object):
@@ -280,20 +496,17 @@ class OID(UniversalPrimitive):
         super().__init__(value=value, data=data)
 
     def _decode_value(self, data):
-        oid = []
-        oid.append(data[0] // 40)
-        oid.append(data[0] % 40)
-        d = bytearray(data[1:])
-        while d:
-            oid.append(decode_varint(d))
+        # the first subidentifier packs two arcs; arc 2 may have a second one >= 40
+        first, pos = decode_varint(data, 0)
+        oid = [min(first // 40, 2)]
+        oid.append(first - 40 * oid[0])
+        oid.extend(decode_varints(data, pos))
         return tuple(oid)
 
     def _encode_value(self, value):
-        data = bytearray()
-        data.append(value[0] * 40 + value[1])
-        for n in value[2:]:
-            data += encode_varint(n)
-        return bytes(data)
+        parts = [encode_varint(value[0] * 40 + value[1])]
+        parts.extend(encode_varint(n) for n in value[2:])
+        return b''.join(parts)
 
     def __str__(self):
         return self.string
@@ -320,12 +533,12 @@ class Integer(UniversalPrimitive):
         return int.from_bytes(data, 'big', signed=True)
 
     def _encode_value(self, value):
-        # extra bit for signed int
-        byte_length = ((value.bit_length() + 8) // 8 )
+        # minimal two's complement: magnitude bits plus a sign bit
+        byte_length = (value if value >= 0 else ~value).bit_length() // 8 + 1
         return value.to_bytes(byte_length, 'big', signed=True)
 
     def __int__(self):
-        return int(self.value)
+        return self.value
 
 class Boolean(Integer):
     TAG = ASN1Tag.Boolean
@@ -333,11 +546,8 @@ class Boolean(Integer):
         return bool(int.from_bytes(data, 'big'))
 
     def _encode_value(self, value):
-        if value == True:
-            # encode True bool as 0xff
-            value = 0xff
-        byte_length = ((value.bit_length() + 7) // 8 )
-        return value.to_bytes(byte_length, 'big')
+        # DER encodes True as 0xff
+        return b'\xff' if value else b'\x00'
 
     def __int__(self):
         return int(self.value)
@@ -391,7 +601,7 @@ class OctetString(UniversalPrimitive):
 class BitString(UniversalPrimitive):
     TAG = ASN1Tag.BitString
     def __int__(self):
-        return int.from_bytes(self.data, 'big')
+        return int.from_bytes(self.value, 'big')
 
 
 def parse(data):
@@ -399,3 +609,5 @@ def parse(data):
         data = data.read()
     return ASN1Object.from_bytes(data)
 
+
+from .schema import compile_schema
@@ -0,0 +1,211 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+""" Compiled versions of the byte-level parsing helpers in berp/__init__.py.
+
+Build in place with `cythonize -i berp/_fast.pyx`; berp falls back to the
+pure-Python implementations when this module isn't built. Building with BMI2
+enabled (e.g. `CFLAGS=-march=native`) decodes and encodes short varints with a
+single PEXT/PDEP instead of a per-byte loop.
+"""
+from libc.stdint cimport uint64_t
+
+cdef extern from *:
+    """
+    #include <stdint.h>
+    #if defined(__BMI2__)
+    #include <immintrin.h>
+    #define BERP_HAVE_BMI2 1
+    #define berp_pext(x, m) _pext_u64((x), (m))
+    #define berp_pdep(x, m) _pdep_u64((x), (m))
+    #else
+    #define BERP_HAVE_BMI2 0
+    #define berp_pext(x, m) ((uint64_t)0)
+    #define berp_pdep(x, m) ((uint64_t)0)
+    #endif
+
+    /* compilers turn this into a single load + bswap */
+    static inline uint64_t berp_load_be64(const unsigned char *p) {
+        return ((uint64_t)p[0] << 56) | ((uint64_t)p[1] << 48) |
+               ((uint64_t)p[2] << 40) | ((uint64_t)p[3] << 32) |
+               ((uint64_t)p[4] << 24) | ((uint64_t)p[5] << 16) |
+               ((uint64_t)p[6] << 8) | (uint64_t)p[7];
+    }
+
+    static inline int berp_clz64(uint64_t x) {
+    #if defined(__GNUC__)
+        return __builtin_clzll(x);
+    #else
+        int n = 0;
+        while (!(x & 0x8000000000000000ULL)) { x <<= 1; n++; }
+        return n;
+    #endif
+    }
+    """
+    bint BERP_HAVE_BMI2
+    uint64_t berp_pext(uint64_t x, uint64_t m) nogil
+    uint64_t berp_pdep(uint64_t x, uint64_t m) nogil
+    uint64_t berp_load_be64(const unsigned char *p) nogil
+    int berp_clz64(uint64_t x) nogil
+
+cdef enum:
+    DER_TAG_EXTENDED = 0x1f
+
+cdef uint64_t DATA_BITS = 0x7f7f7f7f7f7f7f7f
+cdef uint64_t CONT_BITS = 0x8080808080808080
+
+# _read_varint results
+cdef enum:
+    VARINT_OK = 0
+    VARINT_TRUNCATED = 1
+    VARINT_TOO_BIG = 2
+
+
+cdef inline int _read_varint(const unsigned char *p, Py_ssize_t *pos, Py_ssize_t end,
+                             uint64_t *out) noexcept nogil:
+    cdef Py_ssize_t i = pos[0]
+    cdef uint64_t value = 0, word, term
+    cdef int last
+    cdef unsigned char b
+    if BERP_HAVE_BMI2 and end - i >= 8:
+        # varints are MSB-group first, so in a big-endian word the first byte
+        # without a continuation bit is the highest clear 0x80 bit
+        word = berp_load_be64(p + i)
+        term = ~word & CONT_BITS
+        if term:
+            last = berp_clz64(term) >> 3
+            out[0] = berp_pext(word >> (8 * (7 - last)), DATA_BITS)
+            pos[0] = i + last + 1
+            return VARINT_OK
+    while i < end:
+        if value >> 57:
+            return VARINT_TOO_BIG
+        b = p[i]
+        i += 1
+        value = (value << 7) | (b & 0x7f)
+        if not b & 0x80:
+            out[0] = value
+            pos[0] = i
+            return VARINT_OK
+    return VARINT_TRUNCATED
+
+
+cdef tuple _decode_varint_big(const unsigned char[:] buf, Py_ssize_t pos):
+    # decode with Python ints, for values that don't fit 64 bits
+    cdef Py_ssize_t end = buf.shape[0]
+    cdef unsigned char b
+    value = 0
+    while pos < end:
+        b = buf[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7f)
+        if not b & 0x80:
+            return value, pos
+    raise ValueError("truncated varint")
+
+
+cpdef tuple decode_varint(const unsigned char[:] buf, Py_ssize_t pos=0):
+    """ decode a base-128 varint from buf at pos; returns (value, new_pos) """
+    cdef Py_ssize_t end = buf.shape[0]
+    cdef uint64_t value
+    cdef int res
+    if pos < 0:
+        raise ValueError("negative position")
+    if pos >= end:
+        raise ValueError("truncated varint")
+    res = _read_varint(&buf[0], &pos, end, &value)
+    if res == VARINT_OK:
+        return value, pos
+    if res == VARINT_TOO_BIG:
+        return _decode_varint_big(buf, pos)
+    raise ValueError("truncated varint")
+
+
+cpdef list decode_varints(const unsigned char[:] buf, Py_ssize_t pos=0):
+    """ decode the consecutive varints filling buf[pos:]; returns a list of values """
+    cdef Py_ssize_t end = buf.shape[0]
+    cdef uint64_t value
+    cdef int res
+    cdef list values = []
+    if pos < 0:
+        raise ValueError("negative position")
+    while pos < end:
+        res = _read_varint(&buf[0], &pos, end, &value)
+        if res == VARINT_OK:
+            values.append(value)
+        elif res == VARINT_TOO_BIG:
+            big, pos = _decode_varint_big(buf, pos)
+            values.append(big)
+        else:
+            raise ValueError("truncated varint")
+    return values
+
+
+cdef bytes _encode_varint_big(n):
+    nbytes = max(1, (n.bit_length() + 6) // 7)
+    out = bytearray(nbytes)
+    last = nbytes - 1
+    for i in range(nbytes):
+        out[i] = ((n >> (7 * (last - i))) & 0x7f) | (0x80 if i != last else 0)
+    return bytes(out)
+
+
+cpdef bytes encode_varint(n):
+    cdef uint64_t v, groups
+    cdef int nbytes, i
+    cdef unsigned char out[8]
+    if not 0 <= n < (1 << 56):
+        return _encode_varint_big(n)
+    v = n
+    nbytes = 1
+    while nbytes < 8 and v >> (7 * nbytes):
+        nbytes += 1
+    if BERP_HAVE_BMI2:
+        # spread the 7-bit groups into bytes, then flag all but the last one
+        groups = berp_pdep(v, DATA_BITS) | (CONT_BITS & ((<uint64_t>1 << (8 * nbytes - 8)) - 1) << 8)
+        for i in range(nbytes):
+            out[i] = (groups >> (8 * (nbytes - 1 - i))) & 0xff
+    else:
+        for i in range(nbytes):
+            out[i] = ((v >> (7 * (nbytes - 1 - i))) & 0x7f) | (0x80 if i != nbytes - 1 else 0)
+    return out[:nbytes]
+
+
+cpdef tuple decode_header(const unsigned char[:] buf, Py_ssize_t pos, Py_ssize_t end):
+    """ decode a tag+length header from buf[pos:end];
+        returns (tag, cons, asn1cls, length, new_pos), length is None for indefinite """
+    cdef unsigned char head, first
+    cdef Py_ssize_t byte_count
+    cdef unsigned long long length = 0
+    cdef object tag
+    if pos < 0:
+        raise ValueError("negative position")
+    # bounds checking is off, so never trust `end` past the actual buffer
+    if end > buf.shape[0]:
+        end = buf.shape[0]
+    if pos >= end:
+        raise ValueError("truncated der header")
+    head = buf[pos]
+    pos += 1
+    tag = head & 0x1f
+    if tag == DER_TAG_EXTENDED:
+        tag, pos = decode_varint(buf, pos)
+    if pos >= end:
+        raise ValueError("truncated der header")
+
+    first = buf[pos]
+    pos += 1
+    if first == 0x80:
+        return (tag, (head >> 5) & 1, head >> 6, None, pos)
+    if first < 0x80:
+        return (tag, (head >> 5) & 1, head >> 6, first, pos)
+
+    byte_count = first & 0x7f
+    if pos + byte_count > end:
+        raise ValueError("bad der length")
+    if byte_count > 8:
+        big = int.from_bytes(buf[pos:pos + byte_count], 'big')
+        return (tag, (head >> 5) & 1, head >> 6, big, pos + byte_count)
+    while byte_count:
+        length = (length << 8) | buf[pos]
+        pos += 1
+        byte_count -= 1
+    return (tag, (head >> 5) & 1, head >> 6, length, pos)
@@ -0,0 +1,85 @@
+""" Parsers specialized to a fixed structure, generated from a template object. """
+from . import ASN1Object, Constructed, decode_header
+
+
+class _Mismatch(Exception):
+    pass
+
+
+class _Codegen:
+    def __init__(self):
+        self.lines = []
+        self.names = {}
+        self.counter = 0
+
+    def emit(self, line, indent=1):
+        self.lines.append('    ' * indent + line)
+
+    def node(self, template, parent_end):
+        """ emit code parsing `template`'s shape at `pos`; returns the variable holding the object """
+        n = self.counter = self.counter + 1
+        cls = type(template)
+        self.names[f'C{n}'] = cls
+        if getattr(template, '_indefinite', False) or (
+                issubclass(cls, Constructed)
+                and (cls._from_buffer.__func__ is not Constructed._from_buffer.__func__
+                     or cls._decode_value is not Constructed._decode_value)):
+            # nothing to specialize; parse this subtree generically
+            self.emit(f'o{n}, pos = _parse(buf, pos, {parent_end})')
+            self.emit(f'if type(o{n}) is not C{n}: raise _Mismatch')
+            return f'o{n}'
+
+        self.emit(f's{n} = pos')
+        self.emit(f'tag, cons, asn1cls, length, pos = _decode_header(buf, pos, {parent_end})')
+        self.emit(f'if tag != {int(cls.TAG)} or cons != {int(cls.CONS)} or asn1cls != {int(cls.CLASS)} '
+                  f'or length is None: raise _Mismatch')
+        self.emit(f'h{n} = pos')
+        self.emit(f'e{n} = pos + length')
+        self.emit(f'if e{n} > {parent_end}: raise _Mismatch')
+        if isinstance(template, Constructed):
+            children = [self.node(child, f'e{n}') for child in template._value]
+            self.emit(f'if pos != e{n}: raise _Mismatch')
+            self.emit(f'o{n} = C{n}(value=[{", ".join(children)}])')
+            self.emit(f'o{n}._keep_raw(buf, h{n}, e{n})')
+        else:
+            self.emit(f'o{n} = C{n}._from_buffer(buf, h{n}, e{n})')
+        self.emit(f'o{n}.header_length = h{n} - s{n}')
+        self.emit(f'o{n}.length = e{n} - s{n}')
+        self.emit(f'o{n}._indefinite = False')
+        self.emit(f'pos = e{n}')
+        return f'o{n}'
+
+
+def compile_schema(template):
+    """ generate a parse function specialized to the structure of `template`.
+
+        `template` is a decoded (or built) object whose exact shape - tags and
+        child counts - the input is expected to have, e.g. a parsed certificate.
+        The generated function decodes such input with straight-line code and no
+        class lookups; input of any other shape is handed to the generic parser,
+        so the result is always the same as `berp.parse(data)`.
+    """
+    gen = _Codegen()
+    gen.emit('def parse(data):', 0)
+    gen.emit("if hasattr(data, 'read'):")
+    gen.emit('data = data.read()', 2)
+    gen.emit('if not isinstance(data, bytes):')
+    gen.emit('data = bytes(data)', 2)
+    gen.emit('buf = memoryview(data)')
+    gen.emit('end = len(buf)')
+    gen.emit('pos = 0')
+    gen.emit('try:')
+    start = len(gen.lines)
+    root = gen.node(template, 'end')
+    gen.lines[start:] = ['    ' + line for line in gen.lines[start:]]
+    gen.emit(f'return {root}', 2)
+    gen.emit('except (_Mismatch, ValueError):')
+    gen.emit('return ASN1Object.from_bytes(data)', 2)
+
+    source = '\n'.join(gen.lines) + '\n'
+    namespace = dict(gen.names, _Mismatch=_Mismatch, _parse=ASN1Object._parse,
+                     _decode_header=decode_header, ASN1Object=ASN1Object)
+    exec(compile(source, f'<berp schema {type(template).__name__}>', 'exec'), namespace)
+    parse = namespace['parse']
+    parse.source = source
+    return parse
@@ -3,6 +3,8 @@ try:
 except ImportError:
     print('`pip install rupy` for nicer prints')
     from pprint import pprint as pp
+import copy
+
 import berp
 
 def test_symmetry():
@@ -13,6 +15,144 @@ def test_symmetry():
     assert berp.parse(bytes(obj)) == obj
 
 
+def test_compile_schema():
+    fin = 'test/Amazon Root CA 1.cer'
+    data = open(fin, 'rb').read()
+    parse_cert = berp.compile_schema(berp.parse(data))
+    obj = parse_cert(data)
+    assert obj == berp.parse(data)
+    assert bytes(obj) == data
+    # different shape falls back to the generic parser
+    other = bytes(berp.Sequence([berp.Integer(1)]))
+    assert parse_cert(other) == berp.parse(other)
+
+
+class Pair(berp.Constructed):
+    CLASS = berp.ASN1Class.Context
+    TAG = 0x1d
+
+    def _decode_value(self, data):
+        a, b = super()._decode_value(data)
+        return {'a': a, 'b': b}
+
+    def _encode_value(self, value):
+        return super()._encode_value([value['a'], value['b']])
+
+
+def test_custom_constructed():
+    data = b'\xbd\x06\x02\x01\x01\x02\x01\x02'
+    obj = berp.parse(data)
+    assert isinstance(obj, Pair)
+    assert obj.value == {'a': berp.Integer(1), 'b': berp.Integer(2)}
+    assert bytes(obj) == data
+    assert berp.compile_schema(obj)(data).value == obj.value
+
+
+def test_reading_keeps_encoding():
+    fin = 'test/Amazon Root CA 1.cer'
+    data = open(fin, 'rb').read()
+    obj = berp.parse(data)
+    assert obj == berp.parse(data)
+    repr(obj)
+    assert bytes(obj) == data
+    # non-DER input (non-minimal INTEGER / length) encodes the same either way
+    for ber in (b'\x30\x04\x02\x02\x00\x05', b'\x30\x05\x30\x81\x02\x05\x00'):
+        obj = berp.parse(ber)
+        before = bytes(obj)
+        obj.value
+        obj[0].value
+        assert bytes(obj) == before
+
+
+def test_deepcopy():
+    fin = 'test/Amazon Root CA 1.cer'
+    data = open(fin, 'rb').read()
+    obj = copy.deepcopy(berp.parse(data))
+    assert bytes(obj) == data
+
+
+def test_modify():
+    fin = 'test/Amazon Root CA 1.cer'
+    data = open(fin, 'rb').read()
+    obj = berp.parse(data)
+    obj[0][1].value = 1234
+    assert bytes(obj) != data
+    assert berp.parse(bytes(obj))[0][1].value == 1234
+
+
+def test_encoded_child():
+    seq = berp.Sequence([berp.Integer(1), b'\x05\x00'])
+    assert bytes(seq) == b'0\x05\x02\x01\x01\x05\x00'
+    assert seq.data == b'\x02\x01\x01\x05\x00'
+
+
+def test_bitfield():
+    bf = berp.BitField(0b10110100)
+    assert bf[2:5] == 0b101
+    assert bf[5:] == 0b101
+    assert bf[::2] == 0b0110
+    assert bf[3] == 0 and bf[4] == 1
+    bf[2:5] = 0b010
+    assert bf.value == 0b10101000
+    bf[8:10] = 0b11
+    assert bf.value == 0b1110101000
+    bf = berp.BitField(0)
+    bf[6:] = 2
+    assert bf.value == 0x80
+    bf[:5] = 0x1f
+    assert bf.value == 0x9f
+    bf = berp.BitField(0)
+    bf[::2] = 0b11
+    assert bf.value == 0b101
+    bf[1::3] = 0b11
+    assert bf.value == 0b10111
+
+
+def test_varint():
+    for n in (0, 1, 0x7f, 0x80, 0x3fff, 0x4000, 113549, 2 ** 64 + 5):
+        enc = berp.encode_varint(n)
+        assert berp.decode_varint(b'\xaa' + enc, 1) == (n, len(enc) + 1)
+    assert berp.decode_varints(b'\x01\x81', 2) == []
+    assert berp.decode_varints(b'\x01' * 7 + b'\x80\x05') == [1] * 7 + [5]
+    for call in (lambda: berp.decode_varint(b'\x05\x07', -1),
+                 lambda: berp.decode_header(b'\x02\x01\x05', -3, 3),
+                 lambda: berp.decode_header(b'0', 0, 50)):
+        try:
+            call()
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError"
+
+
+def test_unknown_tag_class_reused():
+    data = b'\xa0\x03\x02\x01\x07'
+    assert type(berp.parse(data)) is type(berp.parse(data))
+    key = (0x5, True, berp.ASN1Class.Context)
+    assert berp.Constructed.find_class(*key) is berp.ASN1Object.find_class(*key)
+    assert berp.ASN1Object.find_class(berp.ASN1Tag.Integer, False, berp.ASN1Class.Universal) is berp.Integer
+
+
+def test_oid():
+    for oid in ('1.2.840.113549.1.1.11', '2.5.4.3', '2.999.3', '0.39'):
+        assert berp.parse(bytes(berp.OID(oid))).string == oid
+    assert berp.OID('2.999.3').data == b'\x88\x37\x03'
+    assert berp.OID(data=memoryview(b'\x2a\x86\x48')).string == '1.2.840'
+    assert berp.OID(data=bytearray(b'\x2a\x86\x48')).string == '1.2.840'
+
+
+def test_integer_minimal():
+    for n, enc in ((0, '00'), (127, '7f'), (128, '0080'), (-128, '80'), (-129, 'ff7f'), (-1, 'ff')):
+        assert berp.Integer(n).data.hex() == enc
+        assert berp.parse(bytes(berp.Integer(n))).value == n
+
+
+def test_boolean():
+    assert bytes(berp.Boolean(True)) == b'\x01\x01\xff'
+    assert bytes(berp.Boolean(False)) == b'\x01\x01\x00'
+    assert berp.parse(b'\x01\x01\x00').value is False
+
+
 def test_print():
     fin = 'test/Amazon Root CA 1.cer'
     data = open(fin, 'rb').read()